@@ -2,3 +2,5 @@
 
 __author__ = 'Pablo Alejandro Costesich'
 __docformat__ = 'reStructuredText en'
+
+from memtools.storages import connect, register
@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       fingerprint.py
+#
+#       Copyright 2010 Pablo Alejandro Costesich <pcostesi@alu.itba.edu.ar>
+#
+#       Redistribution and use in source and binary forms, with or without
+#       modification, are permitted provided that the following conditions are
+#       met:
+#
+#       * Redistributions of source code must retain the above copyright
+#         notice, this list of conditions and the following disclaimer.
+#       * Redistributions in binary form must reproduce the above
+#         copyright notice, this list of conditions and the following disclaimer
+#         in the documentation and/or other materials provided with the
+#         distribution.
+#       * Neither the name of the Dev Team nor the names of its
+#         contributors may be used to endorse or promote products derived from
+#         this software without specific prior written permission.
+#
+#       THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#       "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#       LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#       A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#       OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#       SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#       LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#       DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#       THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#       (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#       OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+    Argument fingerprinting for memoization keys. Fingerprints are fed into
+    a hash object in a canonical way: dicts and sets do not depend on their
+    iteration order and objects exposing the buffer protocol (bytearray,
+    array.array, NumPy arrays...) are hashed straight from their memory
+    instead of building a string out of them.
+
+    Custom types can be handled with register(kind, function), where
+    function(fingerprinter, obj, the_hash) updates the_hash.
+
+"""
+
+from array import array
+from hashlib import md5
+from operator import add
+from threading import Lock
+import weakref
+
+
+def _fingerprint_str(fingerprinter, obj, the_hash):
+    the_hash.update("s%d:" % len(obj))
+    the_hash.update(obj)
+
+
+def _fingerprint_unicode(fingerprinter, obj, the_hash):
+    _fingerprint_str(fingerprinter, obj.encode('utf-8'), the_hash)
+
+
+def _fingerprint_scalar(fingerprinter, obj, the_hash):
+    the_hash.update("%s:%r;" % (type(obj).__name__, obj))
+
+
+def _fingerprint_int(fingerprinter, obj, the_hash):
+    # int and long share a tag: the same number can be either one.
+    the_hash.update("int:%d;" % obj)
+
+
+def _fingerprint_float(fingerprinter, obj, the_hash):
+    the_hash.update("float:%r;" % obj)
+
+
+def _fingerprint_sequence(fingerprinter, obj, the_hash):
+    text = fingerprinter._text(obj)
+    if text is not None:
+        return the_hash.update(text)
+    the_hash.update("%s%d[" % (type(obj).__name__, len(obj)))
+    for item in obj:
+        fingerprinter.update(the_hash, item)
+    the_hash.update("]")
+
+
+def _fingerprint_set(fingerprinter, obj, the_hash):
+    the_hash.update("set%d{" % len(obj))
+    for digest in sorted(fingerprinter.digest(item) for item in obj):
+        the_hash.update(digest)
+    the_hash.update("}")
+
+
+def _fingerprint_dict(fingerprinter, obj, the_hash):
+    sortable = frozenset(map(type, obj)) in _sortable
+    if sortable:
+        # Keys of one sortable kind give a canonical order on their own.
+        text = fingerprinter._items_text(obj)
+        if text is not None:
+            return the_hash.update("dict%d{%s}" % (len(obj), text))
+    the_hash.update("dict%d{" % len(obj))
+    if sortable:
+        for key in sorted(obj):
+            fingerprinter.update(the_hash, key)
+            fingerprinter.update(the_hash, obj[key])
+    else:
+        for digest in sorted(fingerprinter.digest(item)
+                for item in obj.iteritems()):
+            the_hash.update(digest)
+    the_hash.update("}")
+
+
+def _fingerprint_array(fingerprinter, obj, the_hash):
+    the_hash.update("array%s%d:" % (obj.typecode, len(obj)))
+    the_hash.update(buffer(obj))
+
+
+def _fingerprint_buffer(fingerprinter, view, the_hash):
+    the_hash.update("buffer%s%r:" % (view.format, view.shape))
+    try:
+        the_hash.update(view)
+    except (TypeError, ValueError, BufferError):
+        # Non contiguous buffers have to be copied.
+        the_hash.update(view.tobytes())
+
+
+def _fingerprint_default(fingerprinter, obj, the_hash):
+    the_hash.update("%s:" % type(obj).__name__)
+    _fingerprint_str(fingerprinter, str(obj), the_hash)
+
+
+def _encode_str(obj):
+    return "s%d:%s" % (len(obj), obj)
+
+
+def _encode_unicode(obj):
+    return _encode_str(obj.encode('utf-8'))
+
+
+_encode_int = "int:%d;".__mod__
+
+# Text encoders for scalars, matching what their default handlers feed into
+# the hash. They let keys made of scalars, tuples and lists be built as one
+# string instead of dispatching every item.
+_encoders = {
+    str: (_fingerprint_str, _encode_str),
+    unicode: (_fingerprint_unicode, _encode_unicode),
+    int: (_fingerprint_int, _encode_int),
+    long: (_fingerprint_int, _encode_int),
+    float: (_fingerprint_float, "float:%r;".__mod__),
+    bool: (_fingerprint_scalar, "bool:%r;".__mod__),
+    type(None): (_fingerprint_scalar, lambda obj: "NoneType:None;"),
+}
+
+# Dict key kinds that can be sorted into a canonical order.
+_sortable = frozenset([frozenset([int]), frozenset([long]),
+        frozenset([int, long]), frozenset([float]), frozenset([str]),
+        frozenset([unicode])])
+
+
+class Fingerprinter(object):
+    """
+        Type-dispatched argument fingerprinting. Handlers are looked up
+        following the MRO of the argument's type; objects with no handler
+        are hashed from their buffer if they have one, or from str()
+        otherwise.
+
+        When `cache_by_identity` is set, digests of objects accepted by
+        `cacheable` (by default, read-only buffers of at least `min_size`
+        bytes) are remembered by identity until the object is collected.
+        Only objects that support weak references can be cached, and they
+        must not be mutated while they are in use as arguments.
+
+    """
+
+    def __init__(self, cache_by_identity=False, min_size=4096,
+            cacheable=None):
+        self._handlers = {}
+        self._dispatch = {}
+        self._fast = {}
+        self._headers = {}
+        self._cache = {}
+        self._cache_lock = Lock()
+        self.cache_by_identity = cache_by_identity
+        self.min_size = min_size
+        if cacheable is not None:
+            self.cacheable = cacheable
+
+    def register(self, kind, function):
+        self._handlers[kind] = function
+        self._dispatch.clear()
+        handler, encode = _encoders.get(kind, (None, None))
+        if function is handler:
+            self._fast[kind] = encode
+        else:
+            self._fast.pop(kind, None)
+        if kind in (tuple, list) and function is _fingerprint_sequence:
+            self._headers[kind] = "%s%%d[" % kind.__name__
+        else:
+            self._headers.pop(kind, None)
+
+    def _encoder(self, objs):
+        """ Returns the text encoder shared by all of objs, or None. """
+        encoders = set([self._fast.get(kind) for kind in set(map(type, objs))])
+        if len(encoders) == 1:
+            return encoders.pop()
+        return None
+
+    def _text(self, obj):
+        """ Returns the fingerprint of obj as a string if it is made only of
+            scalars with a text encoder, tuples and lists, or None.
+        """
+        fast = self._fast
+        kind = type(obj)
+        encode = fast.get(kind)
+        if encode is not None:
+            return encode(obj)
+        header = self._headers.get(kind)
+        if header is None:
+            return None
+        header = header % len(obj)
+        if len(obj) > 16:
+            encode = self._encoder(obj)
+            if encode is not None:
+                return header + "".join(map(encode, obj)) + "]"
+        try:
+            return header + "".join([fast[type(item)](item)
+                    for item in obj]) + "]"
+        except KeyError:
+            pass
+        parts = [header]
+        for item in obj:
+            text = self._text(item)
+            if text is None:
+                return None
+            parts.append(text)
+        parts.append("]")
+        return "".join(parts)
+
+    def _items_text(self, obj):
+        """ Returns the items of a dict with sortable keys as a string, in
+            key order, or None if a key or value has no text encoder.
+        """
+        fast = self._fast
+        # Keys are unique, so sorting the items never compares values.
+        items = sorted(obj.iteritems())
+        if len(items) > 16:
+            keys, values = zip(*items)
+            encode_key = self._encoder(keys)
+            encode_value = self._encoder(values)
+            if encode_key is not None and encode_value is not None:
+                return "".join(map(add, map(encode_key, keys),
+                        map(encode_value, values)))
+        try:
+            return "".join([fast[type(key)](key) + fast[type(value)](value)
+                    for key, value in items])
+        except KeyError:
+            pass
+        text = self._text
+        parts = []
+        for key, value in items:
+            key, value = text(key), text(value)
+            if key is None or value is None:
+                return None
+            parts.append(key)
+            parts.append(value)
+        return "".join(parts)
+
+    def _handler(self, kind):
+        try:
+            return self._dispatch[kind]
+        except KeyError:
+            pass
+        handler = None
+        for base in getattr(kind, '__mro__', (kind,)):
+            if base in self._handlers:
+                handler = self._handlers[base]
+                break
+        self._dispatch[kind] = handler
+        return handler
+
+    def cacheable(self, obj):
+        if isinstance(obj, basestring):
+            return False
+        try:
+            view = memoryview(obj)
+        except TypeError:
+            return False
+        size = view.itemsize
+        for length in view.shape or ():
+            size *= length
+        return view.readonly and size >= self.min_size
+
+    def _cached_digest(self, obj):
+        key = id(obj)
+        try:
+            ref, digest = self._cache[key]
+            if ref() is obj:
+                return digest
+        except KeyError:
+            pass
+        digest = self.digest(obj, use_cache=False)
+        cache = self._cache
+
+        def forget(ref, key=key):
+            with self._cache_lock:
+                if key in cache and cache[key][0] is ref:
+                    del cache[key]
+        try:
+            ref = weakref.ref(obj, forget)
+        except TypeError:
+            return digest
+        with self._cache_lock:
+            cache[key] = (ref, digest)
+        return digest
+
+    def update(self, the_hash, obj, use_cache=True):
+        """ Feeds the fingerprint of obj into the_hash. """
+        if use_cache and self.cache_by_identity and self.cacheable(obj):
+            the_hash.update("#")
+            the_hash.update(self._cached_digest(obj))
+            return
+        handler = self._handler(type(obj))
+        if handler is not None:
+            return handler(self, obj, the_hash)
+        try:
+            view = memoryview(obj)
+        except TypeError:
+            return _fingerprint_default(self, obj, the_hash)
+        return _fingerprint_buffer(self, view, the_hash)
+
+    def digest(self, obj, use_cache=True):
+        """ Returns the binary md5 digest of the fingerprint of obj. """
+        the_hash = md5()
+        self.update(the_hash, obj, use_cache)
+        return the_hash.digest()
+
+    def key(self, name, args, kwargs, hashing_function=md5):
+        """ Returns a hex key for a call to `name` with args and kwargs. """
+        the_hash = hashing_function(name)
+        text = self._text(args)
+        if text is None:
+            self.update(the_hash, args)
+        else:
+            the_hash.update(text)
+        the_hash.update("|")
+        if kwargs:
+            _fingerprint_dict(self, kwargs, the_hash)
+        return the_hash.hexdigest()
+
+
+default_fingerprinter = Fingerprinter()
+register = default_fingerprinter.register
+
+register(str, _fingerprint_str)
+register(unicode, _fingerprint_unicode)
+register(int, _fingerprint_int)
+register(long, _fingerprint_int)
+register(float, _fingerprint_float)
+for kind in (complex, bool, type(None)):
+    register(kind, _fingerprint_scalar)
+register(tuple, _fingerprint_sequence)
+register(list, _fingerprint_sequence)
+register(set, _fingerprint_set)
+register(frozenset, _fingerprint_set)
+register(dict, _fingerprint_dict)
+register(array, _fingerprint_array)
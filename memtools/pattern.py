@@ -34,18 +34,73 @@
 
 
 
-from functools import wraps
+from functools import partial, wraps
 from hashlib import md5
+from inspect import getmro, isgeneratorfunction
+from operator import attrgetter
+from threading import local, Lock
 import logging
+import weakref
+from memtools.fingerprint import default_fingerprinter
+
+
+# Per-thread state of the running top-level call of recursive memoized
+# callables. It is shared by all of them, so mutually recursive functions
+# use the same table.
+_scope = local()
+
+
+def _local_key(args, kwargs):
+    """ Returns a hashable key for a call with args and kwargs, or None if
+        they are not hashable.
+    """
+    lkey = (args, tuple(sorted(kwargs.iteritems()))) if kwargs else args
+    try:
+        hash(lkey)
+    except TypeError:
+        return None
+    return lkey
+
+
+class Subproblem(object):
+    """ Placeholder returned by a recursive memoized generator when it is
+        called from inside a running top-level call. Yielding it back to the
+        driver asks for the value of that subproblem.
+
+    """
+
+    __slots__ = ('memoized', 'args', 'kwargs')
+
+    def __init__(self, memoized, args, kwargs):
+        self.memoized = memoized
+        self.args = args
+        self.kwargs = kwargs
+
 
 class Memoized(object):
     """ This class wraps a normal callable and returns a memoized callable
         with a "memo" storage. End users are not intended to know what happens
         inside this class, neither they should know about it.
 
+        When `recursive` is set, only top-level calls hit the memo. Recursive
+        calls made while a top-level call is running are kept in a local
+        table that lives as long as that call, and the top-level result (plus
+        any subproblem accepted by the `persist` predicate) is written to the
+        memo in a single bulk update when it finishes.
+
+        Recursive generator functions are driven with an explicit stack
+        instead of the Python one, so they do not hit the recursion limit.
+        Each subproblem is requested with ``value = yield f(...)`` and the
+        result is given with a final ``yield value``. The local table is
+        shared by every recursive callable, so they can call each other.
+
+        Keys are built by a Fingerprinter (see memtools.fingerprint) from the
+        function name and its arguments.
+
     """
 
-    def __init__(self, f, memo, hashing_function=md5, debug=False):
+    def __init__(self, f, memo, hashing_function=md5, debug=False,
+            recursive=False, persist=None, fingerprinter=None):
         self.__f = f
         self.__memo = memo
         logging.basicConfig(level=logging.WARNING)
@@ -53,28 +108,301 @@ class Memoized(object):
         if debug:
             self.log.setLevel(logging.DEBUG)
         self.hashing_function = hashing_function
+        self.fingerprinter = fingerprinter or default_fingerprinter
+        self.recursive = recursive
+        self.persist = persist
+        self.__generator = isgeneratorfunction(f)
 
-    def __create_key(self, f, *args, **kwargs):
-#       TODO: Is there another way to create a key?
-        the_hash = self.hashing_function(f.func_name)
-        for arg in args:
-            the_hash.update(str(arg))
-        the_hash.update("|")
-        for key, val in kwargs.iteritems():
-            the_hash.update("%s:%s;" % (key, val))
-        return the_hash.hexdigest()
+    def __create_key(self, f, args, kwargs):
+        return self.fingerprinter.key(f.func_name, args, kwargs,
+                self.hashing_function)
 
     def __call__(self, *args, **kwargs):
+        table = getattr(_scope, 'table', None) if self.recursive else None
+        if table is not None:
+            if self.__generator:
+                return self.__subgenerator(args, kwargs)
+            # Plain subproblems are looked up here rather than in a helper
+            # so that recursion costs two frames per level.
+            lkey = _local_key(args, kwargs)
+            if lkey is None:
+                lkey = self.__create_key(self.__f, args, kwargs)
+            lkey = (self, lkey)
+            try:
+                return table[lkey]
+            except KeyError:
+                pass
+            driving, _scope.driving = _scope.driving, 0
+            try:
+                val = self.__f(*args, **kwargs)
+            finally:
+                _scope.driving = driving
+            table[lkey] = val
+            self.__keep(args, kwargs, val)
+            return val
         key = self.__create_key(self.__f, args, kwargs)
         self.log.debug("Calling memoized value %s", key)
+        if not self.recursive and hasattr(self.__memo, 'fetch'):
+            return self.__memo.fetch(key, partial(self.__f, *args, **kwargs))
         try:
             return self.__memo[key]
         except KeyError:
             self.log.debug("No key %s found. Calculating value...", key)
+            if self.recursive:
+                return self.__top_level(key, args, kwargs)
             val = self.__f(*args, **kwargs)
             self.__memo[key] = val
             return val
 
+    def __local_key(self, args, kwargs):
+        lkey = _local_key(args, kwargs)
+        if lkey is None:
+            lkey = self.__create_key(self.__f, args, kwargs)
+        return (self, lkey)
+
+    def __top_level(self, key, args, kwargs):
+        _scope.table = {}
+        _scope.persisted = {}
+        _scope.running = set()
+        _scope.driving = 0
+        try:
+            if self.__generator:
+                val = self.__drive(args, kwargs)
+            else:
+                val = self.__f(*args, **kwargs)
+            persisted = _scope.persisted
+        finally:
+            _scope.table = _scope.persisted = _scope.running = None
+        persisted.setdefault(self, {})[key] = val
+        for memoized, values in persisted.iteritems():
+            memoized.log.debug("Writing %s values to memory", len(values))
+            memoized.__memo.update(values)
+        return val
+
+    def __keep(self, args, kwargs, val):
+        if self.persist is not None and self.persist(*args, **kwargs):
+            key = self.__create_key(self.__f, args, kwargs)
+            _scope.persisted.setdefault(self, {})[key] = val
+
+    def __subgenerator(self, args, kwargs):
+        if _scope.driving:
+            return Subproblem(self, args, kwargs)
+        # Called from a plain function: drive it from here.
+        lkey = self.__local_key(args, kwargs)
+        try:
+            return _scope.table[lkey]
+        except KeyError:
+            val = self.__drive(args, kwargs)
+            self.__keep(args, kwargs, val)
+            return val
+
+    def __push(self, stack, args, kwargs):
+        lkey = self.__local_key(args, kwargs)
+        if lkey in _scope.running:
+            raise RuntimeError("Cyclic subproblem in %s%r" %
+                    (self.__f.func_name, args))
+        _scope.running.add(lkey)
+        stack.append((self, lkey, args, kwargs, self.__f(*args, **kwargs)))
+
+    def __drive(self, args, kwargs):
+        table = _scope.table
+        stack = []
+        self.__push(stack, args, kwargs)
+        value = None
+        _scope.driving += 1
+        try:
+            while stack:
+                memoized, lkey, sargs, skwargs, gen = stack[-1]
+                try:
+                    result = gen.send(value)
+                except StopIteration:
+                    result = None
+                else:
+                    if isinstance(result, Subproblem):
+                        sub = result.memoized
+                        skey = sub.__local_key(result.args, result.kwargs)
+                        try:
+                            value = table[skey]
+                        except KeyError:
+                            sub.__push(stack, result.args, result.kwargs)
+                            value = None
+                        continue
+                    gen.close()
+                stack.pop()
+                _scope.running.discard(lkey)
+                table[lkey] = result
+                if stack:
+                    memoized.__keep(sargs, skwargs, result)
+                value = result
+        finally:
+            _scope.driving -= 1
+        return value
+
+
+class MemoizedMethod(object):
+    """ Descriptor that memoizes a method per instance, without using
+        str(self) as part of the key.
+
+        Without a memo, caches are kept by the descriptor in a table that
+        holds instances by weak reference and compares them by identity, so
+        a cache goes away with its instance and is not shared with copies
+        or equal instances. Instances that do not support weak references
+        keep their caches in a `_memoized` attribute (their __dict__ or a
+        slot with that name) instead; other classes are rejected with a
+        TypeError on first use.
+
+        With a memo (e.g. a remote Memory), `identity` is required: an
+        attribute name or a callable returning a stable key for the instance,
+        used instead of self to build the memo key. Keys are namespaced by
+        the class that defines the method, found on first use, unless a
+        `namespace` is given. If `forget` is set, the keys written for an
+        instance are deleted from the memo when the instance is collected,
+        which needs instances that support weak references.
+
+    """
+
+    def __init__(self, f, memo=None, identity=None, forget=False,
+            namespace=None, hashing_function=md5, fingerprinter=None):
+        if memo is not None and identity is None:
+            raise TypeError("An identity is required to memoize methods "
+                    "in a Memory")
+        if isinstance(identity, basestring):
+            identity = attrgetter(identity)
+        self.__f = f
+        self.__memo = memo
+        if namespace is None:
+            self.__name = None
+        else:
+            self.__name = "%s.%s" % (namespace, f.func_name)
+        self.__caches = {}
+        self.__owners = {}
+        self.__lock = Lock()
+        self.identity = identity
+        self.forget = forget
+        self.hashing_function = hashing_function
+        self.fingerprinter = fingerprinter or default_fingerprinter
+        logging.basicConfig(level=logging.WARNING)
+        self.log = logging.getLogger("Memoized Method %s" % f.func_name)
+        wraps(f)(self)
+
+    def __get__(self, instance, owner):
+        if self.__name is None:
+            self.__resolve(owner)
+        if owner not in self.__owners:
+            self.__check(owner)
+        if instance is None:
+            return self
+        return partial(self.__call, instance)
+
+    def __call__(self, instance, *args, **kwargs):
+        if self.__name is None:
+            self.__resolve(type(instance))
+        return self.__call(instance, *args, **kwargs)
+
+    def __resolve(self, owner):
+        """ Names keys after the class in owner's MRO that holds this
+            descriptor.
+        """
+        f = self.__f
+        for cls in getmro(owner):
+            if any(value is self for value in vars(cls).itervalues()):
+                self.__name = "%s.%s.%s" % (cls.__module__, cls.__name__,
+                        f.func_name)
+                return
+        self.__name = "%s.%s" % (f.__module__, f.func_name)
+
+    def __check(self, owner):
+        """ Finds out where instances of owner keep their caches: 'weak' for
+            the descriptor's weak table, 'attr' for a _memoized attribute or
+            None when no cache is needed.
+        """
+        weak = getattr(owner, '__weakrefoffset__', 1) != 0
+        if self.__memo is not None and not self.forget:
+            mode = None
+        elif weak:
+            mode = 'weak'
+        elif self.__memo is not None:
+            raise TypeError("%s instances do not support weak references, "
+                    "which forget=True needs" % owner.__name__)
+        elif getattr(owner, '__dictoffset__', 0) or \
+                hasattr(owner, '_memoized'):
+            mode = 'attr'
+        else:
+            raise TypeError("%s instances need __weakref__, __dict__ or a "
+                    "_memoized slot to memoize %s" % (owner.__name__,
+                    self.__f.func_name))
+        self.__owners[owner] = mode
+        return mode
+
+    def __weak_cache(self, instance):
+        key = id(instance)
+        try:
+            ref, cache = self.__caches[key]
+            if ref() is instance:
+                return cache
+        except KeyError:
+            pass
+        caches, lock, memo = self.__caches, self.__lock, self.__memo
+        log = self.log
+
+        def collected(ref, key=key):
+            with lock:
+                if caches.get(key, (None,))[0] is not ref:
+                    return
+                ref, cache = caches.pop(key)
+            if memo is None:
+                return
+            for memo_key in cache:
+                try:
+                    del memo[memo_key]
+                except KeyError:
+                    pass
+                except Exception:
+                    log.debug("Could not forget key %s", memo_key,
+                            exc_info=True)
+        cache = {}
+        ref = weakref.ref(instance, collected)
+        with lock:
+            caches[key] = (ref, cache)
+        return cache
+
+    def __cache(self, instance):
+        owner = type(instance)
+        try:
+            mode = self.__owners[owner]
+        except KeyError:
+            mode = self.__check(owner)
+        if mode == 'weak':
+            return self.__weak_cache(instance)
+        try:
+            caches = instance._memoized
+        except AttributeError:
+            caches = instance._memoized = {}
+        try:
+            return caches[self]
+        except KeyError:
+            return caches.setdefault(self, {})
+
+    def __call(self, instance, *args, **kwargs):
+        if self.__memo is None:
+            cache = self.__cache(instance)
+            lkey = _local_key(args, kwargs)
+            if lkey is None:
+                lkey = self.fingerprinter.key(self.__name, args, kwargs)
+            try:
+                return cache[lkey]
+            except KeyError:
+                val = self.__f(instance, *args, **kwargs)
+                cache[lkey] = val
+                return val
+        key = self.fingerprinter.key(self.__name,
+                (self.identity(instance),) + args, kwargs,
+                self.hashing_function)
+        if self.forget:
+            self.__cache(instance)[key] = True
+        return self.__memo.fetch(key,
+                partial(self.__f, instance, *args, **kwargs))
+
 
 class memoize(object):
     """
@@ -93,6 +421,6 @@ class memoize(object):
         self.debug = debug
 
     def __call__(self, f):
-        memo = Memoized(f, self._memory, self.debug)
+        memo = Memoized(f, self._memory, debug=self.debug)
         wraps(f)(memo)
         return memo
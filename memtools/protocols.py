@@ -40,10 +40,22 @@
 
 
 from functools import wraps
-from memtools.pattern import Memoized
+from memtools.pattern import Memoized, MemoizedMethod
 from StringIO import StringIO
 
 
+def _update_items(E, F):
+    """ Yields dict.update arguments as (key, value, ttl) items. """
+    if hasattr(E, 'keys'):
+        for key in E.keys():
+            yield key, E[key], None
+    else:
+        for key, value in E:
+            yield key, value, None
+    for key, value in F.iteritems():
+        yield key, value, None
+
+
 class KeyFile(StringIO):
 
     def __init__(self, master, key):
@@ -105,6 +117,48 @@ class Memory(object):
         wraps(f)(memo)
         return memo
 
+    def recursive(self, f=None, persist=None):
+        """
+            Same as __call__, but tuned for recursive (dynamic programming)
+            functions: subproblems are memoized in a table local to each
+            top-level call and only the top-level result is stored in this
+            Memory, together with the subproblems for which
+            persist(*args, **kwargs) is true.
+
+            Plain functions recurse on the Python stack, and each level
+            through the memoizer uses about six interpreter levels, so
+            their depth is limited to about a sixth of
+            sys.getrecursionlimit() (some 160 levels by default). For deeper
+            recursions write the function as a generator that yields its
+            subproblems instead of calling them; generators are run without
+            using the Python stack. See Memoized for details.
+
+            It can be used as @memory.recursive or
+            @memory.recursive(persist=predicate).
+
+        """
+        if f is None:
+            return lambda f: self.recursive(f, persist)
+        memo = Memoized(f, self, recursive=True, persist=persist)
+        wraps(f)(memo)
+        return memo
+
+    def method(self, f=None, identity=None, forget=False, namespace=None):
+        """
+            Memoizes a method in this Memory. Instances are keyed by
+            `identity` (an attribute name or a callable) instead of
+            str(self), and methods by their class unless a `namespace` is
+            given. If `forget` is true, an instance's keys are deleted when
+            it is collected.
+
+            It is used as @memory.method(identity='id'). For per-instance
+            caches that do not need a Memory, use MemoizedMethod directly.
+
+        """
+        if f is None:
+            return lambda f: self.method(f, identity, forget, namespace)
+        return MemoizedMethod(f, self, identity, forget, namespace)
+
     def get(self, key, default=None):
         try:
             return self[key]
@@ -114,6 +168,55 @@ class Memory(object):
     def set(self, key, value):
         self[key] = value
 
+    def fetch(self, key, compute):
+        """
+            Returns the value for key, storing the result of compute() if it
+            is missing. Storages that can coordinate concurrent misses should
+            override it.
+
+        """
+        try:
+            return self[key]
+        except KeyError:
+            value = compute()
+            self[key] = value
+            return value
+
+    def update(self, E=(), **F):
+        """
+            Works like dict.update. The values are written through restore
+            with no ttl, so storages that write in bulk there store them in
+            batches as well.
+
+        """
+        self.restore(_update_items(E, F))
+
+    def dump_items(self, keys=None):
+        """
+            Yields (key, value, ttl) for every stored key, or for the given
+            keys that are present, where ttl is the remaining time to live in
+            seconds or None. Storages that cannot list their keys do not
+            implement it.
+
+        """
+        if keys is None:
+            raise NotImplementedError
+        for key in keys:
+            try:
+                yield key, self[key], None
+            except KeyError:
+                pass
+
+    def restore(self, items):
+        """
+            Stores (key, value, ttl) items, as yielded by dump_items. The
+            default implementation ignores ttl and uses the storage's own
+            expire time.
+
+        """
+        for key, value, ttl in items:
+            self[key] = value
+
     def open(self, key):
         return KeyFile(self, key)
 
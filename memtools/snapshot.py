@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       snapshot.py
+#
+#       Copyright 2010 Pablo Alejandro Costesich <pcostesi@alu.itba.edu.ar>
+#
+#       Redistribution and use in source and binary forms, with or without
+#       modification, are permitted provided that the following conditions are
+#       met:
+#
+#       * Redistributions of source code must retain the above copyright
+#         notice, this list of conditions and the following disclaimer.
+#       * Redistributions in binary form must reproduce the above
+#         copyright notice, this list of conditions and the following disclaimer
+#         in the documentation and/or other materials provided with the
+#         distribution.
+#       * Neither the name of the Dev Team nor the names of its
+#         contributors may be used to endorse or promote products derived from
+#         this software without specific prior written permission.
+#
+#       THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#       "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#       LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#       A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#       OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#       SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#       LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#       DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#       THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#       (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#       OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+    Snapshots of Memory contents, used to warm up a cache after a restart.
+
+    A snapshot is a stream of pickled records: a header followed by one
+    (key, value, ttl) tuple per key, where ttl is the time to live left when
+    the snapshot was taken (or None). Hot keys are written first, so loading
+    the beginning of a snapshot already restores the most used keys. They
+    can come from RedisMemory.hot_keys() or from a HotKeyMemory.
+
+    It can also be used from the command line:
+
+        python -m memtools.snapshot export redis://localhost/0 cache.snap
+        python -m memtools.snapshot load memcache://10.0.0.1,10.0.0.2 cache.snap
+
+"""
+
+from itertools import islice
+from optparse import OptionParser
+from time import time
+import gzip
+
+try:
+    from cPickle import Pickler, Unpickler, HIGHEST_PROTOCOL
+except ImportError:
+    from pickle import Pickler, Unpickler, HIGHEST_PROTOCOL
+
+MAGIC = 'memtools-snapshot'
+VERSION = 1
+
+
+def export(memory, fileobj, hot_keys=None):
+    """
+        Writes the contents of memory to fileobj and returns the number of
+        keys written. The storage must implement dump_items.
+
+        hot_keys, if given, are written first and in order. They can be a
+        list of keys or of (key, count) pairs, like the ones returned by
+        the hot_keys() method of RedisMemory and HotKeyMemory. If hot_keys
+        is True, memory.hot_keys() is used.
+
+    """
+    if hot_keys is True:
+        hot_keys = memory.hot_keys()
+    pickler = Pickler(fileobj, HIGHEST_PROTOCOL)
+    pickler.dump((MAGIC, VERSION, time()))
+    count = 0
+    written = set()
+    if hot_keys is not None:
+        hot_keys = [key[0] if isinstance(key, tuple) else key
+                for key in hot_keys]
+        for item in memory.dump_items(hot_keys):
+            pickler.dump(item)
+            pickler.clear_memo()
+            written.add(item[0])
+            count += 1
+    for item in memory.dump_items():
+        if item[0] not in written:
+            pickler.dump(item)
+            pickler.clear_memo()
+            count += 1
+    return count
+
+
+def read(fileobj):
+    """
+        Yields the (key, value, ttl) records of a snapshot, with ttl updated
+        to the time elapsed since it was taken. Expired keys are skipped.
+
+    """
+    unpickler = Unpickler(fileobj)
+    magic, version, created = unpickler.load()
+    if magic != MAGIC or version > VERSION:
+        raise ValueError("Not a memtools snapshot")
+    elapsed = time() - created
+    while True:
+        try:
+            key, value, ttl = unpickler.load()
+        except EOFError:
+            return
+        if ttl is not None:
+            ttl -= elapsed
+            if ttl <= 0:
+                continue
+        yield key, value, ttl
+
+
+def load(memory, fileobj, limit=None, batch=1000):
+    """
+        Streams a snapshot into memory, `batch` keys at a time, and returns
+        the number of keys loaded. If limit is given, only the first `limit`
+        keys (the hottest ones) are loaded.
+
+    """
+    records = read(fileobj)
+    if limit is not None:
+        records = islice(records, limit)
+    count = 0
+    while True:
+        chunk = list(islice(records, batch))
+        if not chunk:
+            return count
+        memory.restore(chunk)
+        count += len(chunk)
+
+
+def _open(filename, mode):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode)
+    return open(filename, mode)
+
+
+def main(argv=None):
+    from memtools.storages import connect
+    parser = OptionParser(usage="%prog export|load URL FILE")
+    parser.add_option("-l", "--limit", type="int",
+            help="load only the first LIMIT keys")
+    parser.add_option("-k", "--hot-keys", metavar="KEYFILE",
+            help="export the keys listed in KEYFILE (one per line) first")
+    parser.add_option("-H", "--hot", type="int", metavar="COUNT",
+            help="export the COUNT most used keys first, as reported by "
+            "the storage (Redis only)")
+    options, args = parser.parse_args(argv)
+    if len(args) != 3 or args[0] not in ('export', 'load'):
+        parser.error("expected export|load URL FILE")
+    command, url, filename = args
+    memory = connect(url, lazy=False)
+    if command == 'export':
+        hot_keys = None
+        if options.hot_keys:
+            with open(options.hot_keys) as keyfile:
+                hot_keys = [line.strip() for line in keyfile if line.strip()]
+        elif options.hot:
+            hot_keys = memory.hot_keys(options.hot)
+        with _open(filename, 'wb') as fileobj:
+            count = export(memory, fileobj, hot_keys)
+    else:
+        with _open(filename, 'rb') as fileobj:
+            count = load(memory, fileobj, options.limit)
+    print "%s: %d keys" % (command, count)
+
+
+if __name__ == '__main__':
+    main()
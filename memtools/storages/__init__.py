@@ -37,7 +37,12 @@ Memory decorator and utilites to speed up access to computationally expensive
 functions.
 """
 
+from __future__ import absolute_import
+
 import random, time
+from inspect import getargspec
+from threading import Lock
+from urlparse import urlsplit, parse_qsl
 from memtools.protocols import Memory
 
 
@@ -75,6 +80,11 @@ class Alzheimer(Memory):
     def __delitem__(self, key):
         self._client.__delitem__(key)
 
+    def dump_items(self, keys=None):
+        if keys is not None:
+            return Memory.dump_items(self, keys)
+        return ((key, value, None) for key, value in self._client.items())
+
     def keys(self, string):
         a = []
         for i in self._client.keys():
@@ -91,3 +101,155 @@ class Alzheimer(Memory):
                             len(self._client)))]]
             except:
                 pass
+
+
+def _option(value):
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    if value.lower() in ('true', 'yes', 'on'):
+        return True
+    if value.lower() in ('false', 'no', 'off'):
+        return False
+    return value
+
+
+def _memory_factory(location, path, max=None, expire=0):
+    from memtools.storages.local import LocalMemory
+    return LocalMemory(max_size=max, expire=expire)
+
+
+def _memcache_factory(location, path, pool=None, expire=0, debug=False,
+        timeout=None, lower_limit=1):
+    servers = location.split(',') if location else ["127.0.0.1:11211"]
+    if pool:
+        from memtools.storages.memcache import MemcacheMemoryPool
+        return MemcacheMemoryPool(servers, expire, upper_limit=pool,
+                lower_limit=lower_limit, debug=debug, timeout=timeout)
+    from memtools.storages.memcache import MemcacheMemory
+    return MemcacheMemory(servers, expire, debug, timeout)
+
+
+def _redis_factory(location, path, pool=None, expire=None, debug=False,
+        lease=None, lease_wait=None, lease_poll=0.05, socket_timeout=None,
+        socket_connect_timeout=None):
+    url = urlsplit('redis://%s' % location)
+    options = {
+        'host': url.hostname or 'localhost',
+        'port': url.port or 6379,
+        'db': int(path.strip('/') or 0),
+    }
+    for name, value in (('password', url.password),
+            ('socket_timeout', socket_timeout),
+            ('socket_connect_timeout', socket_connect_timeout)):
+        if value is not None:
+            options[name] = value
+    if pool:
+        from redis import ConnectionPool
+        options = {'connection_pool': ConnectionPool(max_connections=pool,
+                **options)}
+    from memtools.storages.pyredis import RedisMemory
+    return RedisMemory(expire, debug, lease=lease, lease_wait=lease_wait,
+            lease_poll=lease_poll, **options)
+
+
+_factories = {
+    'memory': _memory_factory,
+    'memcache': _memcache_factory,
+    'redis': _redis_factory,
+}
+
+
+def register(scheme, factory):
+    """ Registers a factory for connection URLs using `scheme`. It will be
+        called as factory(location, path, **options), where location is the
+        network location of the URL and options come from its query string,
+        and it must return a Memory. Options are checked against the
+        factory's arguments when connect() is called, unless it takes
+        **kwargs.
+    """
+    _factories[scheme] = factory
+
+
+class LazyMemory(Memory):
+    """ Memory proxy that builds the actual gateway on first use, so modules
+        that never touch the cache do not pay for importing the client
+        library or opening connections.
+    """
+
+    def __init__(self, factory, *args, **kwargs):
+        self.__factory = factory
+        self.__args = args
+        self.__kwargs = kwargs
+        self.__memory = None
+        self.__lock = Lock()
+
+    def _get_memory(self):
+        if self.__memory is None:
+            with self.__lock:
+                if self.__memory is None:
+                    self.__memory = self.__factory(*self.__args,
+                            **self.__kwargs)
+        return self.__memory
+
+    memory = property(_get_memory)
+
+    def __getitem__(self, key):
+        return self.memory[key]
+
+    def __setitem__(self, key, value):
+        self.memory[key] = value
+
+    def __delitem__(self, key):
+        del self.memory[key]
+
+    def __len__(self):
+        return len(self.memory)
+
+    def __contains__(self, key):
+        return key in self.memory
+
+    def update(self, E=(), **F):
+        self.memory.update(E, **F)
+
+    def fetch(self, key, compute):
+        return self.memory.fetch(key, compute)
+
+    def dump_items(self, keys=None):
+        return self.memory.dump_items(keys)
+
+    def restore(self, items):
+        self.memory.restore(items)
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.memory, attr)
+
+
+def connect(url, lazy=True):
+    """ Returns a Memory for a connection URL, e.g.
+        "redis://host:6379/0?expire=60&pool=16", "memcache://a,b" or
+        "memory://?max=10000". Query parameters are passed to the storage.
+
+        Unless `lazy` is false, the storage module is not imported and no
+        connection is opened until the Memory is first used.
+    """
+    url = urlsplit(url)
+    try:
+        factory = _factories[url.scheme]
+    except KeyError:
+        raise ValueError("Unknown storage scheme %r" % url.scheme)
+    options = dict((str(key), _option(value))
+            for key, value in parse_qsl(url.query))
+    args, varargs, varkw, defaults = getargspec(factory)
+    if varkw is None:
+        unknown = set(options).difference(args[2:])
+        if unknown:
+            raise ValueError("Unknown option(s) for %s:// storages: %s" %
+                    (url.scheme, ", ".join(sorted(unknown))))
+    if lazy:
+        return LazyMemory(factory, url.netloc, url.path, **options)
+    return factory(url.netloc, url.path, **options)
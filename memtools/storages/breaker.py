@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       breaker.py
+#
+#       Copyright 2010 Pablo Alejandro Costesich <pcostesi@alu.itba.edu.ar>
+#
+#       Redistribution and use in source and binary forms, with or without
+#       modification, are permitted provided that the following conditions are
+#       met:
+#
+#       * Redistributions of source code must retain the above copyright
+#         notice, this list of conditions and the following disclaimer.
+#       * Redistributions in binary form must reproduce the above
+#         copyright notice, this list of conditions and the following disclaimer
+#         in the documentation and/or other materials provided with the
+#         distribution.
+#       * Neither the name of the Dev Team nor the names of its
+#         contributors may be used to endorse or promote products derived from
+#         this software without specific prior written permission.
+#
+#       THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#       "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#       LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#       A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#       OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#       SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#       LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#       DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#       THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#       (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#       OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Latency budget and circuit breaker for slow or failing storages. When the
+cache degrades, memoized callables compute their values directly instead of
+waiting on it.
+"""
+
+from threading import Lock
+from time import time
+import logging
+from memtools.protocols import Memory
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreakerMemory(Memory):
+    """
+        Wraps a Memory and stops using it after `failures` consecutive calls
+        that raised an error or took longer than `budget` seconds. While the
+        circuit is open, reads miss and writes are dropped, so values are
+        computed directly. After `reset` seconds one call is let through to
+        probe the storage (half-open): if it works the circuit is closed
+        again, otherwise it stays open for another `reset` seconds.
+
+        A call cannot be interrupted once started, so give the storage its
+        own timeout (e.g. memcache://host?timeout=0.1 or
+        redis://host?socket_timeout=0.1) to bound the worst case.
+
+        Every state change is logged and passed to the callables in
+        `listeners` as listener(breaker, old_state, new_state).
+    """
+
+    def __init__(self, memory, budget=0.05, failures=5, reset=30,
+            errors=(Exception,), listeners=(), debug=False):
+        self.memory = memory
+        self.budget = budget
+        self.failures = failures
+        self.reset = reset
+        self.errors = errors
+        self.listeners = list(listeners)
+        self.state = CLOSED
+        self.transitions = []
+        self._failed = 0
+        self._opened = 0
+        self._probing = False
+        self._lock = Lock()
+        logging.basicConfig(level=logging.WARNING)
+        self.log = logging.getLogger("Circuit-Breaker")
+        if debug:
+            self.log.setLevel(logging.DEBUG)
+
+    def _change(self, state, changes):
+        """ Changes the state, holding the lock. The change is added to
+            `changes` so listeners can be notified once it is released.
+        """
+        old, self.state = self.state, state
+        self.transitions.append((time(), old, state))
+        del self.transitions[:-100]
+        changes.append((old, state))
+
+    def _notify(self, changes):
+        for old, state in changes:
+            self.log.warning("Circuit %s -> %s for %r", old, state,
+                    self.memory)
+            for listener in self.listeners:
+                try:
+                    listener(self, old, state)
+                except Exception:
+                    self.log.exception("Circuit breaker listener failed")
+
+    def _allow(self):
+        """ Returns None if the storage must be skipped, or whether the call
+            is the half-open probe.
+        """
+        changes = []
+        try:
+            with self._lock:
+                if self.state == CLOSED:
+                    return False
+                if self.state == OPEN and time() - self._opened >= self.reset:
+                    self._change(HALF_OPEN, changes)
+                if self.state == HALF_OPEN and not self._probing:
+                    self._probing = True
+                    return True
+                return None
+        finally:
+            self._notify(changes)
+
+    def _record(self, ok, probe):
+        changes = []
+        with self._lock:
+            if probe:
+                self._probing = False
+                self._failed = 0
+                if ok:
+                    self._change(CLOSED, changes)
+                else:
+                    self._opened = time()
+                    self._change(OPEN, changes)
+            elif self.state == CLOSED:
+                self._failed = 0 if ok else self._failed + 1
+                if self._failed >= self.failures:
+                    self._opened = time()
+                    self._change(OPEN, changes)
+        self._notify(changes)
+
+    def _guard(self, operation, *args):
+        """ Runs operation(*args) on the storage. Returns (True, result) if
+            it worked or (False, None) if it was skipped or failed. KeyError
+            is not a failure and is raised; any other exception not in
+            `errors` is raised and counted as a failure.
+        """
+        probe = self._allow()
+        if probe is None:
+            return False, None
+        start = time()
+        ok = False
+        try:
+            result = operation(*args)
+            ok = time() - start <= self.budget
+        except KeyError:
+            ok = time() - start <= self.budget
+            raise
+        except self.errors:
+            self.log.debug("Storage error", exc_info=True)
+            return False, None
+        finally:
+            self._record(ok, probe)
+        return True, result
+
+    def __getitem__(self, key):
+        ok, value = self._guard(self.memory.__getitem__, key)
+        if not ok:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._guard(self.memory.__setitem__, key, value)
+
+    def __delitem__(self, key):
+        self._guard(self.memory.__delitem__, key)
+
+    def fetch(self, key, compute):
+        """ Uses the storage's own fetch, so its miss handling (e.g. Redis
+            leases) is kept. Time spent in compute() does not count against
+            the budget. If the storage is skipped or fails, the value is
+            computed directly.
+        """
+        probe = self._allow()
+        if probe is None:
+            return compute()
+        computed = {}
+
+        def timed_compute():
+            start = time()
+            try:
+                computed['value'] = compute()
+            except:
+                computed['error'] = True
+                raise
+            finally:
+                computed['time'] = time() - start
+            return computed['value']
+        start = time()
+        ok = failed = False
+        try:
+            value = self.memory.fetch(key, timed_compute)
+            ok = time() - start - computed.get('time', 0) <= self.budget
+        except self.errors:
+            if 'error' in computed:
+                ok = time() - start - computed['time'] <= self.budget
+                raise
+            self.log.debug("Storage error", exc_info=True)
+            failed = True
+        except:
+            if 'error' in computed:
+                ok = time() - start - computed['time'] <= self.budget
+            raise
+        finally:
+            self._record(ok, probe)
+        if failed:
+            if 'value' in computed:
+                return computed['value']
+            return compute()
+        return value
+
+    def update(self, E=(), **F):
+        self._guard(lambda: self.memory.update(E, **F))
+
+    def dump_items(self, keys=None):
+        return self.memory.dump_items(keys)
+
+    def restore(self, items):
+        self.memory.restore(items)
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.memory, attr)
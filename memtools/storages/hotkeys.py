@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hotkeys.py
+#
+#       Copyright 2010 Pablo Alejandro Costesich <pcostesi@alu.itba.edu.ar>
+#
+#       Redistribution and use in source and binary forms, with or without
+#       modification, are permitted provided that the following conditions are
+#       met:
+#
+#       * Redistributions of source code must retain the above copyright
+#         notice, this list of conditions and the following disclaimer.
+#       * Redistributions in binary form must reproduce the above
+#         copyright notice, this list of conditions and the following disclaimer
+#         in the documentation and/or other materials provided with the
+#         distribution.
+#       * Neither the name of the Dev Team nor the names of its
+#         contributors may be used to endorse or promote products derived from
+#         this software without specific prior written permission.
+#
+#       THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#       "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#       LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#       A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#       OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#       SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#       LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#       DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#       THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#       (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#       OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Hot key detection for remote storages. A few keys usually take most of the
+traffic to a single memcache or Redis node; HotKeyMemory finds them with a
+count-min sketch and serves them from a small local replica.
+"""
+
+from array import array
+from threading import Lock
+from memtools.protocols import Memory
+from memtools.storages.local import LocalMemory
+
+_MASK = (1 << 64) - 1
+
+
+class CountMinSketch(object):
+    """
+        Approximate frequency counter using depth x width counters. Counts
+        are halved every `decay` additions so old traffic fades away;
+        `total` is the number of additions, halved along with them.
+    """
+
+    def __init__(self, width=2048, depth=4, decay=100000):
+        self.width = width
+        self.depth = depth
+        self.decay = decay
+        self._rows = [array('L', [0]) * width for i in xrange(depth)]
+        self._additions = 0
+        self.total = 0
+        self.halvings = 0
+
+    def _indexes(self, key):
+        # Python's string hashes of similar keys differ only in their low
+        # bits, so they are mixed (MurmurHash3's finalizer) before use.
+        h = hash(key) & _MASK
+        h = ((h ^ (h >> 33)) * 0xff51afd7ed558ccd) & _MASK
+        h = ((h ^ (h >> 33)) * 0xc4ceb9fe1a85ec53) & _MASK
+        h ^= h >> 33
+        h1 = h & 0xffffffff
+        h2 = (h >> 32) | 1
+        width = self.width
+        return [(h1 + i * h2) % width for i in xrange(self.depth)]
+
+    def add(self, key):
+        """ Counts one occurrence of key and returns its estimate. """
+        estimate = None
+        for row, index in zip(self._rows, self._indexes(key)):
+            count = row[index] + 1
+            row[index] = count
+            if estimate is None or count < estimate:
+                estimate = count
+        self._additions += 1
+        self.total += 1
+        if self._additions >= self.decay:
+            self.halve()
+        return estimate
+
+    def __getitem__(self, key):
+        return min(row[index]
+                for row, index in zip(self._rows, self._indexes(key)))
+
+    def halve(self):
+        for row in self._rows:
+            for index in xrange(self.width):
+                row[index] >>= 1
+        self._additions = 0
+        self.total >>= 1
+        self.halvings += 1
+
+
+class HotKeyMemory(Memory):
+    """
+        Wraps a Memory, tracking the `top` most requested keys with a
+        CountMinSketch and keeping their values in a local replica for up to
+        `expire` seconds. Writes and deletes through this object update the
+        replica; writes made elsewhere are seen once the replica expires.
+
+        A key is only admitted after a successful read, once it has been
+        requested at least `min_count` times and makes up at least
+        `min_share` of the recent requests. When `expected_keys` is given,
+        the sketch is made twice as wide so that keys rarely share counters.
+    """
+
+    def __init__(self, memory, top=32, expire=1, width=2048, depth=4,
+            decay=100000, min_share=0.005, min_count=2, expected_keys=None):
+        if expected_keys:
+            width = 2 * expected_keys
+        self.memory = memory
+        self.top = top
+        self.min_share = min_share
+        self.min_count = min_count
+        self.sketch = CountMinSketch(width, depth, decay)
+        self.replica = LocalMemory(max_size=top, expire=expire)
+        self._hot = {}
+        self._floor = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _track(self, key):
+        """ Counts an access to key and returns its estimate, or None if it
+            is a hot key.
+        """
+        with self._lock:
+            halvings = self.sketch.halvings
+            estimate = self.sketch.add(key)
+            if self.sketch.halvings != halvings:
+                for hot in self._hot:
+                    self._hot[hot] >>= 1
+                self._floor >>= 1
+            if key in self._hot:
+                self._hot[key] = estimate
+                return None
+            return estimate
+
+    def _admit(self, key, estimate, value):
+        """ Makes key hot, with the value just read, if its estimate is
+            high enough.
+        """
+        if estimate < max(self.min_count,
+                self.min_share * self.sketch.total):
+            return
+        with self._lock:
+            if key in self._hot:
+                return
+            if len(self._hot) >= self.top:
+                if estimate <= self._floor:
+                    return
+                coldest = min(self._hot, key=self._hot.get)
+                del self._hot[coldest]
+                self.replica.pop(coldest)
+            self._hot[key] = estimate
+            self._floor = min(self._hot.itervalues())
+            self.replica[key] = value
+
+    def __getitem__(self, key):
+        estimate = self._track(key)
+        if estimate is not None:
+            value = self.memory[key]
+            self._admit(key, estimate, value)
+            return value
+        try:
+            value = self.replica[key]
+        except KeyError:
+            self.misses += 1
+            value = self.memory[key]
+            self.replica[key] = value
+        else:
+            self.hits += 1
+        return value
+
+    def fetch(self, key, compute):
+        estimate = self._track(key)
+        if estimate is not None:
+            value = self.memory.fetch(key, compute)
+            self._admit(key, estimate, value)
+            return value
+        try:
+            value = self.replica[key]
+        except KeyError:
+            self.misses += 1
+            value = self.memory.fetch(key, compute)
+            self.replica[key] = value
+        else:
+            self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self.memory[key] = value
+        if key in self._hot:
+            self.replica[key] = value
+
+    def __delitem__(self, key):
+        self.replica.pop(key)
+        del self.memory[key]
+
+    def update(self, E=(), **F):
+        self.memory.update(E, **F)
+        self.replica.clear()
+
+    def dump_items(self, keys=None):
+        return self.memory.dump_items(keys)
+
+    def restore(self, items):
+        self.memory.restore(items)
+        self.replica.clear()
+
+    def hot_keys(self):
+        """ Returns the current hot keys with their estimated counts, most
+            requested first.
+        """
+        with self._lock:
+            return sorted(self._hot.iteritems(), key=lambda item: item[1],
+                    reverse=True)
+
+    def hit_rate(self):
+        """ Returns the fraction of hot key reads served by the replica. """
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.memory, attr)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       local.py
+#
+#       Copyright 2010 Pablo Alejandro Costesich <pcostesi@alu.itba.edu.ar>
+#
+#       Redistribution and use in source and binary forms, with or without
+#       modification, are permitted provided that the following conditions are
+#       met:
+#
+#       * Redistributions of source code must retain the above copyright
+#         notice, this list of conditions and the following disclaimer.
+#       * Redistributions in binary form must reproduce the above
+#         copyright notice, this list of conditions and the following disclaimer
+#         in the documentation and/or other materials provided with the
+#         distribution.
+#       * Neither the name of the Dev Team nor the names of its
+#         contributors may be used to endorse or promote products derived from
+#         this software without specific prior written permission.
+#
+#       THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#       "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#       LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#       A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#       OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#       SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#       LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#       DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#       THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#       (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#       OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from memtools.protocols import Memory
+
+
+class LocalMemory(Memory):
+    """
+        In-process Memory with an optional size limit (least recently used
+        keys are evicted first) and an optional expire time in seconds.
+    """
+
+    def __init__(self, max_size=None, expire=0):
+        self._client = OrderedDict()
+        self._lock = Lock()
+        self.max_size = max_size
+        self._expire = expire
+
+    def __getitem__(self, key):
+        with self._lock:
+            value, deadline = self._client.pop(key)
+            if deadline and deadline <= time():
+                raise KeyError(key)
+            self._client[key] = (value, deadline)
+            return value
+
+    def __setitem__(self, key, value):
+        deadline = time() + self._expire if self._expire else 0
+        with self._lock:
+            self._client.pop(key, None)
+            self._client[key] = (value, deadline)
+            if self.max_size is not None:
+                while len(self._client) > self.max_size:
+                    self._client.popitem(last=False)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._client[key]
+
+    def dump_items(self, keys=None):
+        now = time()
+        with self._lock:
+            if keys is None:
+                items = self._client.items()
+            else:
+                items = [(key, self._client[key]) for key in keys
+                        if key in self._client]
+        return ((key, value, deadline - now if deadline else None)
+                for key, (value, deadline) in items
+                if not deadline or deadline > now)
+
+    def restore(self, items):
+        now = time()
+        for key, value, ttl in items:
+            ttl = ttl or self._expire
+            with self._lock:
+                self._client.pop(key, None)
+                self._client[key] = (value, now + ttl if ttl else 0)
+                if self.max_size is not None:
+                    while len(self._client) > self.max_size:
+                        self._client.popitem(last=False)
+
+    def __len__(self):
+        return len(self._client)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value, deadline = self._client.pop(key, (default, 0))
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._client.clear()
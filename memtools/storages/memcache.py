@@ -31,13 +31,20 @@
 #       (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 #       OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from __future__ import absolute_import
 
+
+from itertools import islice
+from math import ceil
 from threading import Lock, Thread
+from time import time
 from memcache import Client as MemcacheClient
 import logging
 from memtools.protocols import Memory, MemoryPool, KeyFile
 from memtools.storages import NotSet, OutOfBounds
 
+# Memcache reads expire times longer than this as unix timestamps.
+MAX_RELATIVE_EXPIRE = 60 * 60 * 24 * 30
 
 
 class MemcacheMemory(Memory):
@@ -45,12 +52,17 @@ class MemcacheMemory(Memory):
         Memory gateway to a Memcache server
     """
 
-    def __init__(self, servers=["127.0.0.1:11211"], expire=0, debug=False):
+    def __init__(self, servers=["127.0.0.1:11211"], expire=0, debug=False,
+            timeout=None):
         """
             :param servers: List of servers to use. Please, read
             memcache.Client help.
+            :param timeout: Socket timeout in seconds.
         """
-        self._client = MemcacheClient(servers)
+        if timeout is None:
+            self._client = MemcacheClient(servers)
+        else:
+            self._client = MemcacheClient(servers, socket_timeout=timeout)
         self._expire = expire
         logging.basicConfig(level=logging.WARNING)
         self.log = logging.getLogger("Memcache-Gateway")
@@ -77,6 +89,35 @@ class MemcacheMemory(Memory):
         if self._client.delete(key) == 0:
             raise KeyError
 
+    def _expire_time(self, ttl):
+        """ Converts a time to live in seconds (or None, for the default
+            expire time) to a memcache expire time. Partial seconds are
+            rounded up so they do not become 0 (never expire).
+        """
+        ttl = ttl or self._expire
+        if not ttl:
+            return 0
+        expire = int(ceil(ttl))
+        if expire > MAX_RELATIVE_EXPIRE:
+            return int(time()) + expire
+        return expire
+
+    def restore(self, items, batch=1000):
+        """ Stores (key, value, ttl) items with one set_multi per expire
+            time for every `batch` items.
+        """
+        items = iter(items)
+        while True:
+            groups = {}
+            for key, value, ttl in islice(items, batch):
+                if value is None:
+                    value = NotSet()
+                groups.setdefault(self._expire_time(ttl), {})[key] = value
+            if not groups:
+                return
+            for expire, values in groups.iteritems():
+                self._client.set_multi(values, expire)
+
     def open(self, key):
         return KeyFile(self, key)
 
@@ -84,10 +125,11 @@ class MemcacheMemory(Memory):
 class MemcacheMemoryPool(MemoryPool):
 
     def __init__(self, servers=["127.0.0.1:11211"], expire=0, upper_limit=100,
-            lower_limit=1, debug=False):
+            lower_limit=1, debug=False, timeout=None):
         super(MemcacheMemoryPool, self).__init__()
-        self._clients = [MemcacheMemory(servers=servers, expire=expire) for o
-                in xrange(0, abs(upper_limit + lower_limit) / 2)]
+        self._clients = [MemcacheMemory(servers=servers, expire=expire,
+                timeout=timeout) for o in xrange(lower_limit)]
+        self._timeout = timeout
         self.__expire = expire
         self._servers = servers
         self.upper_limit = upper_limit
@@ -121,8 +163,7 @@ class MemcacheMemoryPool(MemoryPool):
         self.log.debug("Adding %s new servers to the pool", number)
         self.__clients_lock.acquire()
         for i in range(number):
-            self._clients.append(MemcacheMemory(self._servers, self._expire,
-                    self.__debug))
+            self._clients.append(self._new_client())
         self.__clients_lock.release()
 
     def shrink(self, number=1):
@@ -132,41 +173,54 @@ class MemcacheMemoryPool(MemoryPool):
             self._clients.pop()
         self.__clients_lock.release()
 
+    def _new_client(self):
+        return MemcacheMemory(self._servers, self._expire, self.__debug,
+                self._timeout)
+
     def _claim_client(self):
-        if self.count() < self.lower_limit:
-            self.grow()
+        self.__clients_lock.acquire()
         try:
-            self.__clients_lock.acquire()
+            if len(self._clients) < max(self.lower_limit, 1):
+                self._clients.append(self._new_client())
             return self._clients.pop()
         finally:
             self.__clients_lock.release()
 
     def _return_client(self, client):
-        if self.count() < self.upper_limit:
-            self.__clients_lock.acquire()
-            self._clients.append(client)
+        self.__clients_lock.acquire()
+        try:
+            if len(self._clients) < self.upper_limit:
+                self._clients.append(client)
+        finally:
             self.__clients_lock.release()
 
     def __getitem__(self, key):
         self.log.debug("Accessing key %s", key)
+        client = self._claim_client()
         try:
-            client = self._claim_client()
             return client[key]
         finally:
-            self.__return_client(client)
+            self._return_client(client)
 
     def __setitem__(self, key, value):
         self.log.debug("Setting key %s to %s", key, value)
+        client = self._claim_client()
         try:
-            client = self._claim_client()
             client[key] = value
         finally:
             self._return_client(client)
 
     def __delitem__(self, key):
         self.log.debug("Deleting key %s", key)
+        client = self._claim_client()
         try:
-            client = self._claim_client()
             client.__delitem__(key)
         finally:
             self._return_client(client)
+
+    def restore(self, items, batch=1000):
+        client = self._claim_client()
+        try:
+            client.restore(items, batch)
+        finally:
+            self._return_client(client)
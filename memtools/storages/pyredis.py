@@ -31,8 +31,15 @@
 #       (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 #       OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from __future__ import absolute_import
+
 from redis import Redis as RedisClient
 import logging
+from heapq import heappush, heappushpop
+from itertools import islice
+from math import ceil
+from time import time, sleep
+from uuid import uuid4
 from memtools.protocols import Memory, MemoryPool
 from memtools.storages import NotSet, OutOfBounds
 
@@ -42,9 +49,37 @@ except ImportError:
     from pickle import dumps, loads
 
 
+# Stores KEYS[1] (with an optional expire time) and releases the lease
+# KEYS[2] if it is still held by the caller, all in one round-trip.
+_SET_AND_RELEASE = """
+if tonumber(ARGV[2]) > 0 then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+else
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+if redis.call('GET', KEYS[2]) == ARGV[3] then
+    redis.call('DEL', KEYS[2])
+end
+"""
+
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
 class RedisMemory(Memory):
     """
         Memory gateway to a Redis server
+
+        When created with a `lease` time (in seconds), fetch() protects keys
+        from stampedes across processes and hosts: on a miss only the caller
+        that acquires a lease on the key (SET NX PX) computes the value, and
+        the rest poll for it every `lease_poll` seconds for up to
+        `lease_wait` seconds (by default, the lease time) before computing it
+        themselves.
     """
 
     def __init__(self, expire=None, debug=False,
@@ -54,8 +89,16 @@ class RedisMemory(Memory):
             redis.Redis help.
 
         """
+        self.lease = kwargs.pop('lease', None)
+        self.lease_wait = kwargs.pop('lease_wait', None) or self.lease
+        self.lease_poll = kwargs.pop('lease_poll', 0.05)
         self._client = RedisClient(*args, **kwargs)
-        self._expire = expire
+        # SET EX and the lease script only take whole seconds.
+        self._expire = int(ceil(expire)) if expire else expire
+        if self.lease:
+            self._set_and_release = self._client.register_script(
+                    _SET_AND_RELEASE)
+            self._release = self._client.register_script(_RELEASE)
         logging.basicConfig(level=logging.WARNING)
         self.log = logging.getLogger("Redis-Gateway")
         if debug:
@@ -73,15 +116,125 @@ class RedisMemory(Memory):
 
     def __setitem__(self, key, value):
         self.log.debug("Setting key %s to %s", key, value)
-        self._client.set(key, dumps(value))
-        if self._expire:
-            self._client.expire(key, self._expire)
+        self._client.set(key, dumps(value), ex=self._expire or None)
 
     def __delitem__(self, key):
         self.log.debug("Deleting key %s", key)
         if self._client.delete(key) == 0:
             raise KeyError
 
+    def fetch(self, key, compute):
+        if not self.lease:
+            return super(RedisMemory, self).fetch(key, compute)
+        lease_key = "%s:lease" % key
+        token = uuid4().hex
+        deadline = time() + self.lease_wait
+        while True:
+            value = self._client.get(key)
+            if value is not None:
+                return loads(str(value))
+            if self._client.set(lease_key, token, nx=True,
+                    px=int(self.lease * 1000)):
+                self.log.debug("Acquired lease for key %s", key)
+                try:
+                    value = compute()
+                except:
+                    self._release(keys=[lease_key], args=[token])
+                    raise
+                self._set_and_release(keys=[key, lease_key],
+                        args=[dumps(value), self._expire or 0, token])
+                return value
+            if time() >= deadline:
+                self.log.debug("Gave up waiting for key %s", key)
+                value = compute()
+                self[key] = value
+                return value
+            sleep(self.lease_poll)
+
+    def dump_items(self, keys=None, match=None, batch=1000):
+        """
+            Yields (key, value, ttl) for the keys matching `match` (all of
+            them by default), walking the database with SCAN and reading
+            `batch` keys per round-trip. Lease and non memtools keys are
+            skipped.
+        """
+        if keys is None:
+            keys = self._client.scan_iter(match=match, count=batch)
+        chunk = []
+        for key in keys:
+            chunk.append(key)
+            if len(chunk) >= batch:
+                for item in self.__dump_chunk(chunk):
+                    yield item
+                chunk = []
+        for item in self.__dump_chunk(chunk):
+            yield item
+
+    def __dump_chunk(self, keys):
+        keys = [key for key in keys if not key.endswith(":lease")]
+        if not keys:
+            return
+        pipe = self._client.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(key)
+            pipe.pttl(key)
+        replies = pipe.execute()
+        for key, value, pttl in zip(keys, replies[::2], replies[1::2]):
+            if value is None:
+                continue
+            try:
+                value = loads(str(value))
+            except Exception:
+                self.log.debug("Skipping key %s", key)
+                continue
+            yield key, value, pttl / 1000.0 if pttl > 0 else None
+
+    def hot_keys(self, count=100, match=None, batch=1000):
+        """ Returns up to `count` (key, score) pairs for the most used keys
+            matching `match`, hottest first. The score is OBJECT FREQ when
+            the server uses an LFU maxmemory-policy, and OBJECT IDLETIME
+            (lower is hotter) otherwise.
+        """
+        try:
+            policy = self._client.config_get('maxmemory-policy')
+            lfu = 'lfu' in policy.get('maxmemory-policy', '')
+        except Exception:
+            lfu = False
+        subcommand = 'FREQ' if lfu else 'IDLETIME'
+        sign = 1 if lfu else -1
+        heap = []
+        keys = self._client.scan_iter(match=match, count=batch)
+        while True:
+            chunk = [key for key in islice(keys, batch)
+                    if not key.endswith(":lease")]
+            if not chunk:
+                break
+            pipe = self._client.pipeline(transaction=False)
+            for key in chunk:
+                pipe.execute_command('OBJECT', subcommand, key)
+            for key, score in zip(chunk, pipe.execute(raise_on_error=False)):
+                if score is None or isinstance(score, Exception):
+                    continue
+                if len(heap) < count:
+                    heappush(heap, (sign * score, key))
+                else:
+                    heappushpop(heap, (sign * score, key))
+        return [(key, sign * score) for score, key in sorted(heap,
+                reverse=True)]
+
+    def restore(self, items, batch=1000):
+        """ Stores (key, value, ttl) items using pipelines of `batch`
+            commands.
+        """
+        pipe = self._client.pipeline(transaction=False)
+        for count, (key, value, ttl) in enumerate(items, 1):
+            # Round up so that sub-second ttls do not become 0 (no expiry).
+            expire = int(ceil(ttl)) if ttl else self._expire
+            pipe.set(key, dumps(value), ex=expire or None)
+            if count % batch == 0:
+                pipe.execute()
+        pipe.execute()
+
     def expire(self, key, time):
         self.log.debug("Setting expire time to %s seconds for key %s",
                 time, key)